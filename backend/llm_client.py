@@ -4,30 +4,264 @@ LLM Client using Google AI Studio SDK
 """
 
 import google.generativeai as genai
+import fastjsonschema
+import asyncio
+import atexit
+import copy
+import hashlib
+import io
 import json
-from typing import Dict, Any
-from semantic_parser import SemanticLayerParser
+import re
+from collections import OrderedDict
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+from semantic_parser import SemanticLayerParser, get_parser
+from semantic_cache import SemanticCache
+
+
+# Intent shape (see build_system_prompt). The pieces below are shared by the
+# Gemini response schema and the stricter local INTENT_SCHEMA validator.
+INTENT_TYPES = ["metric_query", "segment_breakdown", "comparison"]
+INTENT_REQUIRED = ["intent", "metric"]
+
+SEGMENT_REF_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string"},
+        "name": {"type": "string"}
+    },
+    "required": ["type", "name"]
+}
+
+COMPARISON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "segment_a": SEGMENT_REF_SCHEMA,
+        "segment_b": SEGMENT_REF_SCHEMA
+    },
+    "required": ["segment_a", "segment_b"]
+}
+
+# Sent to Gemini as response_schema. Gemini accepts an OpenAPI subset, so
+# this uses format/nullable and has no per-intent conditionals.
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "format": "enum", "enum": INTENT_TYPES},
+        "metric": {"type": "string"},
+        "segment_type": {"type": "string", "nullable": True},
+        "segment": {"type": "string", "nullable": True},
+        "comparison": COMPARISON_SCHEMA
+    },
+    "required": INTENT_REQUIRED
+}
+
+# Stricter than RESPONSE_SCHEMA: also checks that each intent carries the
+# fields it needs, so callers can index them directly
+INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"enum": INTENT_TYPES},
+        "metric": {"type": "string"},
+        "segment_type": {"type": ["string", "null"]},
+        "segment": {"type": ["string", "null"]}
+    },
+    "required": INTENT_REQUIRED,
+    "allOf": [
+        {
+            "if": {"properties": {"intent": {"const": "segment_breakdown"}}},
+            "then": {"properties": {"segment_type": {"type": "string"}}, "required": ["segment_type"]}
+        },
+        {
+            # Only comparisons need real segment refs; other intents may echo the
+            # prompt's empty {"segment_a": {}, "segment_b": {}} placeholder
+            "if": {"properties": {"intent": {"const": "comparison"}}},
+            "then": {"properties": {"comparison": COMPARISON_SCHEMA}, "required": ["comparison"]}
+        }
+    ]
+}
+
+# Compiled once at import: fastjsonschema generates a plain Python validator function
+validate_intent = fastjsonschema.compile(INTENT_SCHEMA)
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for cache lookups (ignores case, whitespace and trailing punctuation)"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
+
+class _CacheFile:
+    """
+    JSON sidecar file of cached intents, shared by every client using it
+    
+    Clients on the same resolved path and fingerprint share one in-memory
+    LRU (`entries`), so none of them can overwrite another's answers. On save
+    the entries are merged into whatever the file already holds, which also
+    keeps entries written by other processes.
+    """
+    
+    def __init__(self, path: Path, fingerprint: str, size: int):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.size = size
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict(self.read())
+        self.dirty = False
+    
+    def read(self, warn: bool = True) -> "OrderedDict[str, Dict[str, Any]]":
+        """Read the valid, current entries from disk (newest last)"""
+        entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        if not self.path.exists():
+            return entries
+        
+        try:
+            with open(self.path, 'r') as f:
+                contents = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            if warn:
+                print(f"⚠️  Ignoring unreadable cache file {self.path}: {e}")
+            return entries
+        
+        # Entries produced from a different semantic layer, prompt or model are stale
+        if not isinstance(contents, dict) or contents.get('fingerprint') != self.fingerprint:
+            if warn:
+                print(f"⚠️  Ignoring stale cache file {self.path}")
+            return entries
+        
+        stored = contents.get('entries', {})
+        if not isinstance(stored, dict):
+            if warn:
+                print(f"⚠️  Ignoring malformed cache file {self.path}")
+            return entries
+        
+        # Entries may predate schema validation or be edited by hand; drop invalid ones
+        dropped = 0
+        for key, intent in list(stored.items())[-self.size:]:
+            try:
+                entries[key] = validate_intent(intent)
+            except fastjsonschema.JsonSchemaException:
+                dropped += 1
+        
+        if dropped and warn:
+            print(f"⚠️  Dropped {dropped} invalid entries from cache file {self.path}")
+        
+        return entries
+    
+    def save(self):
+        """Merge in-memory entries into the file, if anything changed"""
+        if not self.dirty:
+            return
+        
+        merged = self.read(warn=False)
+        for key, intent in self.entries.items():
+            merged.pop(key, None)
+            merged[key] = intent
+        while len(merged) > self.size:
+            merged.popitem(last=False)
+        
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'fingerprint': self.fingerprint, 'entries': merged}, f)
+            tmp_path.replace(self.path)
+            self.dirty = False
+        except OSError as e:
+            # The in-memory cache is still valid; only persistence failed
+            print(f"⚠️  Could not write cache file {self.path}: {e}")
+
+
+# One _CacheFile per (resolved path, fingerprint) for the whole process. The
+# registry holds no reference to clients, so clients can be freed normally.
+_cache_files: Dict[Tuple[Path, str], _CacheFile] = {}
+
+
+def _get_cache_file(path: str, fingerprint: str, size: int) -> _CacheFile:
+    key = (Path(path).resolve(), fingerprint)
+    if key not in _cache_files:
+        _cache_files[key] = _CacheFile(key[0], fingerprint, size)
+    cache_file = _cache_files[key]
+    cache_file.size = max(cache_file.size, size)
+    return cache_file
+
+
+@atexit.register
+def _save_cache_files():
+    for cache_file in _cache_files.values():
+        cache_file.save()
+
 
 class LLMClient:
     """Client for Google AI Studio (Gemini)"""
     
-    def __init__(self, api_key: str, semantic_parser: SemanticLayerParser):
-        genai.configure(api_key=api_key)
+    def __init__(self, api_key: str, semantic_parser: Optional[SemanticLayerParser] = None,
+                 cache_path: Optional[str] = None, cache_size: int = 1024,
+                 semantic_threshold: Optional[float] = None,
+                 semantic_ttl_seconds: Optional[float] = None):
+        # The SDK is configured and the model built lazily on first use (see `model`)
+        self._api_key = api_key
         
         # Use a working model
-        model_name = 'models/gemini-2.5-flash'  # Fixed: use full path
-        print(f"\nUsing model: {model_name}")
+        self.model_name = 'models/gemini-2.5-flash'  # Fixed: use full path
+        
+        # Native JSON mode: the model returns JSON shaped by RESPONSE_SCHEMA, no
+        # markdown fences. Per-intent requirements are checked by validate_intent.
+        self.generation_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=RESPONSE_SCHEMA
+        )
         
-        self.model = genai.GenerativeModel(model_name)
-        self.parser = semantic_parser
+        # Share the process-wide parser unless one is passed in
+        self.parser = semantic_parser or get_parser()
         
-        self.segments = semantic_parser.list_all_segments()
-        self.metrics = semantic_parser.list_all_metrics()
+        self.segments = self.parser.list_all_segments()
+        self.metrics = self.parser.list_all_metrics()
+        
+        # Exact-match LRU cache of parsed intents, keyed on normalized question
+        # (shared with other clients on the same cache_path, see _CacheFile).
+        # Inserts only mark it dirty; the file is written by save_cache(),
+        # after each batch and once at interpreter exit.
+        self._cache_size = cache_size
+        self._cache_file = None
+        if cache_path and cache_size > 0:
+            self._cache_file = _get_cache_file(cache_path, self._cache_fingerprint, cache_size)
+            self._cache = self._cache_file.entries
+        else:
+            self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        
+        # Optional embedding-similarity cache for paraphrased questions
+        self.semantic_cache = None
+        if semantic_threshold is not None:
+            self.semantic_cache = SemanticCache(
+                threshold=semantic_threshold,
+                ttl_seconds=semantic_ttl_seconds,
+                max_entries=cache_size
+            )
+    
+    @cached_property
+    def model(self) -> genai.GenerativeModel:
+        """Gemini model, configured and constructed on first use"""
+        genai.configure(api_key=self._api_key)
+        print(f"\nUsing model: {self.model_name}")
+        return genai.GenerativeModel(self.model_name)
+    
+    @cached_property
+    def _system_prompt(self) -> str:
+        # Segments and metrics never change after load, so build the prompt once
+        return self.build_system_prompt()
+    
+    @cached_property
+    def _cache_fingerprint(self) -> str:
+        """Identifies the prompt (and so the semantic layer) and model behind cached intents"""
+        source = f"{self.model_name}\n{self._system_prompt}"
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
     
     def build_system_prompt(self) -> str:
-        segments_text = ""
+        # Build text with list.append + join rather than += so it stays linear
+        # as the taxonomy grows (generate_segment_breakdown does the same)
+        segment_lines = []
         for seg_type, seg_list in self.segments.items():
-            segments_text += f"\n  {seg_type}: {', '.join(seg_list)}"
+            segment_lines.append(f"\n  {seg_type}: {', '.join(seg_list)}")
+        segments_text = "".join(segment_lines)
         
         metrics_text = "\n  ".join(self.metrics)
         
@@ -64,43 +298,191 @@ IMPORTANT:
 """
         return prompt
     
+    def save_cache(self):
+        """Write cached intents to the JSON sidecar file, if configured and changed"""
+        if self._cache_file:
+            self._cache_file.save()
+    
     def parse_question(self, question: str) -> Dict[str, Any]:
-        system_prompt = self.build_system_prompt()
-        full_prompt = f"{system_prompt}\n\nUser question: {question}\n\nResponse (JSON only):"
+        """
+        Parse a natural language question into a structured intent
+        
+        Repeated questions (ignoring case and whitespace) are answered from
+        the cache without calling the LLM. If the semantic cache is enabled,
+        close paraphrases of earlier questions are too. Error intents are
+        never cached.
+        """
+        key = normalize_question(question)
+        intent = self._lookup_exact(key)
+        if intent is not None:
+            return intent
+        
+        vector = None
+        if self.semantic_cache:
+            vector = self.semantic_cache.embed(key)
+            intent = self._lookup_semantic(key, vector)
+            if intent is not None:
+                return intent
         
+        intent = self._generate_intent(question)
+        self._store(key, vector, intent)
+        return intent
+    
+    async def aparse_question(self, question: str) -> Dict[str, Any]:
+        """Async version of parse_question, for running many questions concurrently"""
+        key = normalize_question(question)
+        intent = self._lookup_exact(key)
+        if intent is not None:
+            return intent
+        
+        vector = None
+        if self.semantic_cache:
+            # Embedding is CPU-bound; run it off the event loop so a batch's
+            # embeddings and LLM calls overlap. The lookup itself stays on the loop.
+            vector = await asyncio.to_thread(self.semantic_cache.embed, key)
+            intent = self._lookup_semantic(key, vector)
+            if intent is not None:
+                return intent
+        
+        intent = await self._agenerate_intent(question)
+        self._store(key, vector, intent)
+        return intent
+    
+    async def parse_questions_batch(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """
+        Parse several questions concurrently
+        
+        The LLM calls overlap, so wall-clock time is roughly one round trip
+        instead of one per question. Questions that normalize to the same
+        cache key are only sent once.
+        
+        Returns:
+            Intents in the same order as the questions
+        """
+        # First question seen for each key is the one sent to the LLM
+        unique: Dict[str, str] = {}
+        for question in questions:
+            unique.setdefault(normalize_question(question), question)
+        
+        results = await asyncio.gather(
+            *(self.aparse_question(q) for q in unique.values()),
+            return_exceptions=True
+        )
+        
+        self.save_cache()
+        
+        by_key = {
+            key: {"intent": "error", "reason": f"LLM error: {str(r)}"} if isinstance(r, Exception) else r
+            for key, r in zip(unique, results)
+        }
+        
+        # Each caller gets its own copy, as with cache hits
+        return [copy.deepcopy(by_key[normalize_question(q)]) for q in questions]
+    
+    def _lookup_exact(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a normalized question in the exact-match cache"""
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return copy.deepcopy(self._cache[key])
+        
+        return None
+    
+    def _lookup_semantic(self, key: str, vector: Any) -> Optional[Dict[str, Any]]:
+        """Look up an embedded question in the semantic cache, remembering hits by exact key"""
+        intent = self.semantic_cache.lookup(vector)
+        
+        # The exact-match cache never expires, so promoting a hit would
+        # outlive semantic_ttl_seconds; only promote when there is no TTL
+        if intent is not None and self.semantic_cache.ttl_seconds is None:
+            self._remember(key, intent)
+        return intent
+    
+    def _store(self, key: str, vector: Any, intent: Dict[str, Any]):
+        """Cache a freshly generated intent unless it is an error"""
+        if intent.get('intent') == 'error':
+            return
+        
+        self._remember(key, intent)
+        if self.semantic_cache:
+            self.semantic_cache.add(vector, intent)
+    
+    def _remember(self, key: str, intent: Dict[str, Any]):
+        """Store an intent in the exact-match cache"""
+        if self._cache_size <= 0:
+            return
+        
+        self._cache[key] = copy.deepcopy(intent)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        if self._cache_file:
+            self._cache_file.dirty = True
+    
+    def _build_prompt(self, question: str) -> str:
+        return f"{self._system_prompt}\n\nUser question: {question}\n\nResponse (JSON only):"
+    
+    def _generate_intent(self, question: str) -> Dict[str, Any]:
         try:
-            response = self.model.generate_content(full_prompt)
-            response_text = response.text.strip()
-            
-            # Remove markdown code blocks if present
-            if response_text.startswith('```json'):
-                response_text = response_text[7:]
-            if response_text.startswith('```'):
-                response_text = response_text[3:]
-            if response_text.endswith('```'):
-                response_text = response_text[:-3]
+            response = self.model.generate_content(
+                self._build_prompt(question),
+                generation_config=self.generation_config,
+                stream=True
+            )
             
-            response_text = response_text.strip()
+            # Drain the stream as chunks arrive, parse once it closes
+            buffer = io.StringIO()
+            for chunk in response:
+                if chunk.parts:
+                    buffer.write(chunk.text)
+            return self._parse_response(buffer.getvalue())
+        except Exception as e:
+            return {
+                "intent": "error",
+                "reason": f"LLM error: {str(e)}"
+            }
+    
+    async def _agenerate_intent(self, question: str) -> Dict[str, Any]:
+        try:
+            response = await self.model.generate_content_async(
+                self._build_prompt(question),
+                generation_config=self.generation_config,
+                stream=True
+            )
             
+            buffer = io.StringIO()
+            async for chunk in response:
+                if chunk.parts:
+                    buffer.write(chunk.text)
+            return self._parse_response(buffer.getvalue())
+        except Exception as e:
+            return {
+                "intent": "error",
+                "reason": f"LLM error: {str(e)}"
+            }
+    
+    def _parse_response(self, response_text: str) -> Dict[str, Any]:
+        """Parse the raw LLM response text into an intent dict validated against INTENT_SCHEMA"""
+        try:
             intent = json.loads(response_text)
-            return intent
-            
         except json.JSONDecodeError as e:
             return {
                 "intent": "error",
                 "reason": f"Failed to parse LLM response: {e}",
-                "raw_response": response_text if 'response_text' in locals() else "No response"
+                "raw_response": response_text
             }
-        except Exception as e:
+        
+        try:
+            return validate_intent(intent)
+        except fastjsonschema.JsonSchemaException as e:
             return {
                 "intent": "error",
-                "reason": f"LLM error: {str(e)}"
+                "reason": f"Invalid LLM response: {e.message}",
+                "raw_response": response_text
             }
 
 
 if __name__ == "__main__":
     import os
-    from query_generator import QueryGenerator
+    from query_generator import QueryGenerator, format_results
     import duckdb
     
     print("="*60)
@@ -113,8 +495,14 @@ if __name__ == "__main__":
         print("\n❌ ERROR: GOOGLE_API_KEY not set!")
         exit(1)
     
-    parser = SemanticLayerParser()
-    llm = LLMClient(api_key, parser)
+    parser = get_parser()
+    semantic_threshold = os.environ.get('LLM_SEMANTIC_THRESHOLD')
+    llm = LLMClient(
+        api_key,
+        parser,
+        cache_path=os.environ.get('LLM_CACHE_PATH'),
+        semantic_threshold=float(semantic_threshold) if semantic_threshold else None
+    )
     generator = QueryGenerator(parser)
     
     con = duckdb.connect(':memory:')
@@ -126,16 +514,18 @@ if __name__ == "__main__":
         "Compare CLV for high value vs low value customers",
     ]
     
-    for i, question in enumerate(test_questions, 1):
+    # Parse all questions concurrently up front
+    intents = asyncio.run(llm.parse_questions_batch(test_questions))
+    
+    for i, (question, intent) in enumerate(zip(test_questions, intents), 1):
         print(f"\n{'='*60}")
         print(f"Test {i}: {question}")
         print('='*60)
         
         print("\n1. LLM Understanding:")
-        intent = llm.parse_question(question)
         print(f"   Intent: {json.dumps(intent, indent=2)}")
         
-        if intent.get('intent') == 'metric_query':
+        if intent['intent'] == 'metric_query':
             print("\n2. Generated SQL:")
             filters = None
             if intent.get('segment'):
@@ -143,38 +533,38 @@ if __name__ == "__main__":
                     'segment_type': intent.get('segment_type'),
                     'segment': intent.get('segment')
                 }
-            sql = generator.generate_metric_sql(intent['metric'], filters)
+            sql, params = generator.generate_metric_sql(intent['metric'], filters)
             print(f"   {sql}")
             
             print("\n3. Result:")
-            result = con.execute(sql).fetchone()
+            result = con.execute(sql, params).fetchone()
             print(f"   Answer: ${result[0]:.2f}")
         
-        elif intent.get('intent') == 'segment_breakdown':
+        elif intent['intent'] == 'segment_breakdown':
             print("\n2. Generated SQL:")
-            sql = generator.generate_segment_breakdown(
+            sql, params = generator.generate_segment_breakdown(
                 intent['metric'],
                 intent['segment_type']
             )
             print(f"   {sql}")
+            print(f"   Parameters: {params}")
             
             print("\n3. Results:")
-            results = con.execute(sql).df()
-            print(results)
+            print(format_results(con.execute(sql, params)))
         
-        elif intent.get('intent') == 'comparison':
+        elif intent['intent'] == 'comparison':
             print("\n2. Generated SQL:")
             comp = intent['comparison']
-            sql = generator.generate_comparison_query(
+            sql, params = generator.generate_comparison_query(
                 intent['metric'],
                 comp['segment_a'],
                 comp['segment_b']
             )
             print(f"   {sql}")
+            print(f"   Parameters: {params}")
             
             print("\n3. Results:")
-            results = con.execute(sql).df()
-            print(results)
+            print(format_results(con.execute(sql, params)))
         
         else:
             print(f"\n❌ Intent: {intent}")
@@ -11,8 +11,39 @@ executable SQL queries. It handles:
 - Consistent SQL generation for repeatable results
 """
 
-from semantic_parser import SemanticLayerParser
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from semantic_parser import SemanticLayerParser, get_parser
+from typing import Dict, Any, Optional, List, Tuple, NamedTuple
+
+
+class GeneratedQuery(NamedTuple):
+    """
+    SQL text plus its positional parameters
+    
+    Segment labels are bound as `?` parameters rather than interpolated, so
+    the SQL text for a given signature never changes and label values from
+    YAML can't break out of a string literal. Run with con.execute(sql, params).
+    """
+    sql: str
+    params: Tuple[Any, ...] = ()
+
+
+def format_results(cursor) -> str:
+    """
+    Format the rows of an executed DuckDB query as an aligned text table
+    
+    Uses fetchall() + description directly, so printing results doesn't
+    need pandas or a DataFrame copy.
+    """
+    columns = [col[0] for col in cursor.description]
+    rows = [columns] + [[str(value) for value in row] for row in cursor.fetchall()]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    
+    return "\n".join(
+        "  ".join(value.rjust(width) for value, width in zip(row, widths))
+        for row in rows
+    )
+
 
 class QueryGenerator:
     """
@@ -23,16 +54,50 @@ class QueryGenerator:
     logic and ensure consistency.
     """
     
-    def __init__(self, semantic_parser: SemanticLayerParser):
+    def __init__(self, semantic_parser: Optional[SemanticLayerParser] = None,
+                 cache_size: int = 1024):
         """
         Initialize the query generator
         
         Args:
             semantic_parser: Instance of SemanticLayerParser with loaded YAML files
+                (defaults to the shared get_parser() instance)
+            cache_size: Maximum number of memoized queries (0 disables memoization)
         """
-        self.parser = semantic_parser
+        self.parser = semantic_parser or get_parser()
+        
+        # Generated SQL is a pure function of the (fixed) semantic layer and the
+        # request signature, so memoize it in a bounded LRU: repeat requests
+        # become a dict hit. Only queries whose metric and segments resolved
+        # are stored, so made-up names from the LLM don't accumulate.
+        self._sql_cache_size = cache_size
+        self._sql_cache: "OrderedDict[Tuple, GeneratedQuery]" = OrderedDict()
+    
+    def clear_cache(self):
+        """Forget memoized SQL (call after reloading the semantic layer)"""
+        self._sql_cache.clear()
+    
+    def _cached(self, cache_key: Tuple) -> Optional[GeneratedQuery]:
+        if cache_key in self._sql_cache:
+            self._sql_cache.move_to_end(cache_key)
+            return self._sql_cache[cache_key]
+        return None
+    
+    def _memoize(self, cache_key: Tuple, query: GeneratedQuery) -> GeneratedQuery:
+        if self._sql_cache_size > 0:
+            self._sql_cache[cache_key] = query
+            if len(self._sql_cache) > self._sql_cache_size:
+                self._sql_cache.popitem(last=False)
+        return query
     
-    def generate_metric_sql(self, metric_name: str, filters: Optional[Dict] = None) -> str:
+    def _require_metric(self, metric_name: str) -> Dict:
+        """Look up a metric definition (O(1) via the parser's index), raising if unknown"""
+        metric = self.parser.get_metric(metric_name)
+        if not metric:
+            raise ValueError(f"Metric '{metric_name}' not found in semantic layer")
+        return metric
+    
+    def generate_metric_sql(self, metric_name: str, filters: Optional[Dict] = None) -> GeneratedQuery:
         """
         Generate SQL for a metric with optional filters
         
@@ -41,12 +106,21 @@ class QueryGenerator:
             filters: Optional filters like {'segment': 'parents', 'segment_type': 'family_status'}
         
         Returns:
-            SQL query string
+            GeneratedQuery (SQL string and parameters)
         """
+        segment_type = filters.get('segment_type') if filters else None
+        segment_name = filters.get('segment') if filters else None
+        if not (segment_type and segment_name):
+            # Incomplete filters are ignored, so they share the unfiltered query
+            segment_type = segment_name = None
+        
+        cache_key = ('metric', metric_name, segment_type, segment_name)
+        cached = self._cached(cache_key)
+        if cached:
+            return cached
+        
         # Get metric definition
-        metric = self.parser.get_metric(metric_name)
-        if not metric:
-            raise ValueError(f"Metric '{metric_name}' not found in semantic layer")
+        metric = self._require_metric(metric_name)
         
         # Get metric SQL
         metric_sql = metric.get('sql', '').strip()
@@ -54,15 +128,14 @@ class QueryGenerator:
         # Build WHERE clause from filters
         where_clauses = []
         
-        if filters:
-            segment_type = filters.get('segment_type')
-            segment_name = filters.get('segment')
-            
-            if segment_type and segment_name:
-                segment = self.parser.get_customer_segment(segment_type, segment_name)
-                if segment:
-                    segment_definition = segment.get('definition')
-                    where_clauses.append(f"({segment_definition})")
+        segment_found = True
+        if segment_type and segment_name:
+            segment = self.parser.get_customer_segment(segment_type, segment_name)
+            if segment:
+                segment_definition = segment.get('definition')
+                where_clauses.append(f"({segment_definition})")
+            else:
+                segment_found = False
         
         # Build complete query
         if metric.get('type') == 'sum' or metric.get('type') == 'calculated':
@@ -89,9 +162,13 @@ class QueryGenerator:
             # Other types
             query = f"SELECT {metric_sql} FROM customers"
         
-        return query.strip()
+        generated = GeneratedQuery(query.strip())
+        if not segment_found:
+            # Unknown segment: the filter is dropped, don't memoize the result
+            return generated
+        return self._memoize(cache_key, generated)
     
-    def generate_segment_breakdown(self, metric_name: str, segment_type: str) -> str:
+    def generate_segment_breakdown(self, metric_name: str, segment_type: str) -> GeneratedQuery:
         """
         Generate SQL to show metric broken down by segment
         
@@ -100,12 +177,15 @@ class QueryGenerator:
             segment_type: Type of segment (e.g., 'customer_age_segments', 'family_status')
         
         Returns:
-            SQL query string
+            GeneratedQuery (SQL string and parameters)
         """
+        cache_key = ('breakdown', metric_name, segment_type)
+        cached = self._cached(cache_key)
+        if cached:
+            return cached
+        
         # Get metric
-        metric = self.parser.get_metric(metric_name)
-        if not metric:
-            raise ValueError(f"Metric '{metric_name}' not found")
+        metric = self._require_metric(metric_name)
         
         metric_sql = metric.get('sql', '').strip()
         
@@ -115,12 +195,14 @@ class QueryGenerator:
         
         # Build CASE statement for segments
         case_clauses = []
+        labels = []
         for seg_name, seg_def in segments.items():
             if isinstance(seg_def, dict):
                 definition = seg_def.get('definition')
                 label = seg_def.get('label', seg_name)
                 if definition:
-                    case_clauses.append(f"WHEN {definition} THEN '{label}'")
+                    case_clauses.append(f"WHEN {definition} THEN ?")
+                    labels.append(label)
         
         case_statement = "CASE\n    " + "\n    ".join(case_clauses) + "\n    ELSE 'Other'\nEND"
         
@@ -136,9 +218,13 @@ class QueryGenerator:
         ORDER BY avg_value DESC
         """
         
-        return query.strip()
+        generated = GeneratedQuery(query.strip(), tuple(labels))
+        if not case_clauses:
+            # Unknown segment type: the CASE is empty, don't memoize the result
+            return generated
+        return self._memoize(cache_key, generated)
     
-    def generate_comparison_query(self, metric_name: str, segment_a: Dict, segment_b: Dict) -> str:
+    def generate_comparison_query(self, metric_name: str, segment_a: Dict, segment_b: Dict) -> GeneratedQuery:
         """
         Generate SQL to compare metric across two segments
         
@@ -148,11 +234,16 @@ class QueryGenerator:
             segment_b: {'type': 'family_status', 'name': 'no_children'}
         
         Returns:
-            SQL query string
+            GeneratedQuery (SQL string and parameters)
         """
-        metric = self.parser.get_metric(metric_name)
-        if not metric:
-            raise ValueError(f"Metric '{metric_name}' not found")
+        cache_key = ('comparison', metric_name,
+                     segment_a['type'], segment_a['name'],
+                     segment_b['type'], segment_b['name'])
+        cached = self._cached(cache_key)
+        if cached:
+            return cached
+        
+        metric = self._require_metric(metric_name)
         
         metric_sql = metric.get('sql', '').strip()
         
@@ -163,27 +254,28 @@ class QueryGenerator:
         if not seg_a or not seg_b:
             raise ValueError("Segment not found")
         
+        # Single scan: aggregate both segments with FILTER clauses, then
+        # unnest the pair of results back into one row per segment
         query = f"""
         SELECT 
-            '{seg_a.get("label")}' as segment,
-            COUNT(*) as customers,
-            ROUND(AVG({metric_sql}), 2) as avg_value
-        FROM customers
-        WHERE ({seg_a.get('definition')})
-          AND Income IS NOT NULL
-        
-        UNION ALL
-        
-        SELECT 
-            '{seg_b.get("label")}' as segment,
-            COUNT(*) as customers,
-            ROUND(AVG({metric_sql}), 2) as avg_value
-        FROM customers
-        WHERE ({seg_b.get('definition')})
-          AND Income IS NOT NULL
+            UNNEST([?, ?]) as segment,
+            UNNEST([customers_a, customers_b]) as customers,
+            UNNEST([avg_a, avg_b]) as avg_value
+        FROM (
+            SELECT 
+                COUNT(*) FILTER (WHERE {seg_a.get('definition')}) as customers_a,
+                ROUND(AVG({metric_sql}) FILTER (WHERE {seg_a.get('definition')}), 2) as avg_a,
+                COUNT(*) FILTER (WHERE {seg_b.get('definition')}) as customers_b,
+                ROUND(AVG({metric_sql}) FILTER (WHERE {seg_b.get('definition')}), 2) as avg_b
+            FROM customers
+            WHERE Income IS NOT NULL
+        )
         """
         
-        return query.strip()
+        return self._memoize(cache_key, GeneratedQuery(
+            query.strip(),
+            (seg_a.get('label'), seg_b.get('label'))
+        ))
 
 
 # Test the query generator
@@ -195,7 +287,7 @@ if __name__ == "__main__":
     print("="*60)
     
     # Initialize
-    parser = SemanticLayerParser()
+    parser = get_parser()
     generator = QueryGenerator(parser)
     
     # Connect to DuckDB
@@ -204,41 +296,39 @@ if __name__ == "__main__":
     
     # Test 1: Simple metric query
     print("\n1. Average total spending for ALL customers:")
-    sql = generator.generate_metric_sql('total_spending')
+    sql, params = generator.generate_metric_sql('total_spending')
     print(f"\nGenerated SQL:\n{sql}\n")
-    result = con.execute(sql).fetchone()
+    result = con.execute(sql, params).fetchone()
     print(f"Result: ${result[0]:.2f}")
     
     # Test 2: Metric with segment filter
     print("\n" + "="*60)
     print("2. Average total spending for PARENTS:")
-    sql = generator.generate_metric_sql(
+    sql, params = generator.generate_metric_sql(
         'total_spending', 
         filters={'segment_type': 'family_status', 'segment': 'parents'}
     )
     print(f"\nGenerated SQL:\n{sql}\n")
-    result = con.execute(sql).fetchone()
+    result = con.execute(sql, params).fetchone()
     print(f"Result: ${result[0]:.2f}")
     
     # Test 3: Segment breakdown
     print("\n" + "="*60)
     print("3. Total spending by age segment:")
-    sql = generator.generate_segment_breakdown('total_spending', 'customer_age_segments')
-    print(f"\nGenerated SQL:\n{sql}\n")
-    results = con.execute(sql).df()
-    print(results)
+    sql, params = generator.generate_segment_breakdown('total_spending', 'customer_age_segments')
+    print(f"\nGenerated SQL:\n{sql}\nParameters: {params}\n")
+    print(format_results(con.execute(sql, params)))
     
     # Test 4: Comparison
     print("\n" + "="*60)
     print("4. Compare CLV: Parents vs No Children:")
-    sql = generator.generate_comparison_query(
+    sql, params = generator.generate_comparison_query(
         'customer_lifetime_value',
         {'type': 'family_status', 'name': 'parents'},
         {'type': 'family_status', 'name': 'no_children'}
     )
-    print(f"\nGenerated SQL:\n{sql}\n")
-    results = con.execute(sql).df()
-    print(results)
+    print(f"\nGenerated SQL:\n{sql}\nParameters: {params}\n")
+    print(format_results(con.execute(sql, params)))
     
     print("\n" + "="*60)
     print("✅ Query Generator Working!")
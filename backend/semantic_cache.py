@@ -0,0 +1,119 @@
+# backend/semantic_cache.py
+"""
+Semantic Cache
+Reuses parsed intents for paraphrased questions via embedding similarity
+
+Questions are embedded with a small sentence-transformer and stored in a
+FAISS inner-product index. Vectors are L2-normalized, so the inner product
+is the cosine similarity. A lookup returns the cached intent of the nearest
+stored question when its similarity is at or above the threshold.
+
+Requires the optional packages `sentence-transformers` and `faiss-cpu`.
+"""
+
+import copy
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import faiss
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional dependencies
+    faiss = None
+    np = None
+    SentenceTransformer = None
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of (question embedding, intent) pairs"""
+
+    def __init__(self, threshold: float = 0.92, ttl_seconds: Optional[float] = None,
+                 max_entries: int = 1024, model_name: str = 'all-MiniLM-L6-v2'):
+        """
+        Initialize the semantic cache
+
+        Args:
+            threshold: Minimum cosine similarity for a cache hit
+            ttl_seconds: Optional lifetime of an entry; None keeps entries forever
+            max_entries: Oldest entries are evicted beyond this size
+            model_name: Sentence-transformer model used for embeddings
+        """
+        if SentenceTransformer is None or faiss is None:
+            raise ImportError(
+                "Semantic cache requires 'sentence-transformers' and 'faiss-cpu': "
+                "pip install sentence-transformers faiss-cpu"
+            )
+
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self.encoder = SentenceTransformer(model_name)
+
+        # IndexIDMap lets entries be removed by id, so eviction never rebuilds the index
+        self.index = faiss.IndexIDMap(
+            faiss.IndexFlatIP(self.encoder.get_sentence_embedding_dimension())
+        )
+
+        # id -> (intent, timestamp), in insertion order (so oldest entries come first)
+        self._entries: "OrderedDict[int, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._next_id = 0
+
+    def embed(self, question: str):
+        """Return the normalized embedding of a question as a (1, dim) float32 array"""
+        vector = self.encoder.encode([question], normalize_embeddings=True)
+        return np.asarray(vector, dtype='float32')
+
+    def lookup(self, vector) -> Optional[Dict[str, Any]]:
+        """
+        Find the cached intent closest to an embedded question
+
+        Returns:
+            Copy of the cached intent, or None if nothing is similar enough
+        """
+        self.evict_expired()
+
+        if self.index.ntotal == 0:
+            return None
+
+        scores, ids = self.index.search(vector, 1)
+        if ids[0][0] < 0 or scores[0][0] < self.threshold:
+            return None
+
+        intent, _ = self._entries[int(ids[0][0])]
+        return copy.deepcopy(intent)
+
+    def add(self, vector, intent: Dict[str, Any]):
+        """Store an embedded question and its parsed intent"""
+        entry_id = self._next_id
+        self._next_id += 1
+
+        self._entries[entry_id] = (copy.deepcopy(intent), time.monotonic())
+        self.index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+
+        if len(self._entries) > self.max_entries:
+            self._evict(len(self._entries) - self.max_entries)
+
+    def evict_expired(self):
+        """Drop entries older than the TTL"""
+        if self.ttl_seconds is None or not self._entries:
+            return
+
+        cutoff = time.monotonic() - self.ttl_seconds
+
+        # Entries are inserted in time order, so expired entries form a prefix
+        expired = 0
+        for _, ts in self._entries.values():
+            if ts >= cutoff:
+                break
+            expired += 1
+
+        if expired:
+            self._evict(expired)
+
+    def _evict(self, count: int):
+        """Drop the oldest `count` entries"""
+        ids = [self._entries.popitem(last=False)[0] for _ in range(count)]
+        self.index.remove_ids(np.array(ids, dtype='int64'))
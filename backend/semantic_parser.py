@@ -4,9 +4,24 @@ Semantic Layer Parser
 Reads and parses taxonomy.yml, metadata.yml, and semantic_layer.yml
 """
 
+import functools
+import sys
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Tuple, Mapping
+
+# Use the libyaml C parser when PyYAML was built with it (much faster), else pure Python
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+def _intern(value: Any) -> Any:
+    """Intern strings used as lookup keys (PyYAML does not intern keys)"""
+    return sys.intern(value) if isinstance(value, str) else value
 
 class SemanticLayerParser:
     def __init__(self, semantic_dir: str = "semantic"):
@@ -15,6 +30,12 @@ class SemanticLayerParser:
         self.metadata = None
         self.metrics = None
         
+        # Lookup indexes, rebuilt by load_all()
+        self._segments_index: Mapping[str, Tuple[str, ...]] = MappingProxyType({})
+        self._metrics_index: Tuple[str, ...] = ()
+        self._segments_by_key: Dict[Tuple[str, str], Any] = {}
+        self._metrics_by_name: Dict[str, Dict] = {}
+        
         # Load all YAML files on init
         self.load_all()
     
@@ -26,20 +47,61 @@ class SemanticLayerParser:
             raise FileNotFoundError(f"File not found: {filepath}")
         
         with open(filepath, 'r') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=SafeLoader)
     
     def load_all(self):
         """Load all semantic layer files"""
         print("Loading semantic layer files...")
         
-        self.taxonomy = self.load_yaml('taxonomy.yml')
-        print("✅ Loaded taxonomy.yml")
+        # Read the files concurrently so cold-storage I/O overlaps
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            taxonomy = executor.submit(self.load_yaml, 'taxonomy.yml')
+            metadata = executor.submit(self.load_yaml, 'metadata.yml')
+            metrics = executor.submit(self.load_yaml, 'semantic_layer.yml')
+            
+            self.taxonomy = taxonomy.result()
+            print("✅ Loaded taxonomy.yml")
+            
+            self.metadata = metadata.result()
+            print("✅ Loaded metadata.yml")
+            
+            self.metrics = metrics.result()
+            print("✅ Loaded semantic_layer.yml")
+        
+        self.build_indexes()
+    
+    def build_indexes(self):
+        """
+        Precompute segment and metric lookups so accessors don't re-walk the YAML
         
-        self.metadata = self.load_yaml('metadata.yml')
-        print("✅ Loaded metadata.yml")
+        Names are interned, so lookups with the same strings (e.g. literals
+        in calling code) compare by identity instead of character by character.
+        """
+        taxonomy = self.taxonomy.get('taxonomy', {})
         
-        self.metrics = self.load_yaml('semantic_layer.yml')
-        print("✅ Loaded semantic_layer.yml")
+        segments_index = {}
+        self._segments_by_key = {}
+        for segment_type, segments in taxonomy.items():
+            if not isinstance(segments, dict):
+                continue
+            segment_type = _intern(segment_type)
+            segment_names = tuple(_intern(name) for name in segments.keys())
+            for segment_name, segment in zip(segment_names, segments.values()):
+                self._segments_by_key[(segment_type, segment_name)] = segment
+            if segment_type not in ['metadata']:
+                segments_index[segment_type] = segment_names
+        
+        # Read-only views: the parser is shared (see get_parser), so callers can't mutate it
+        self._segments_index = MappingProxyType(segments_index)
+        
+        metrics_list = self.metrics.get('metrics', [])
+        self._metrics_index = tuple(_intern(m['name']) for m in metrics_list if 'name' in m)
+        
+        # First definition wins, matching the previous linear scan
+        self._metrics_by_name = {}
+        for metric in metrics_list:
+            if 'name' in metric:
+                self._metrics_by_name.setdefault(_intern(metric['name']), metric)
     
     def get_customer_segment(self, segment_type: str, segment_name: str) -> Optional[Dict]:
         """
@@ -52,13 +114,7 @@ class SemanticLayerParser:
         Returns:
             Dictionary with segment definition or None
         """
-        taxonomy = self.taxonomy.get('taxonomy', {})
-        segments = taxonomy.get(segment_type, {})
-        
-        if segment_name in segments:
-            return segments[segment_name]
-        
-        return None
+        return self._segments_by_key.get((segment_type, segment_name))
     
     def get_metric(self, metric_name: str) -> Optional[Dict]:
         """
@@ -70,13 +126,7 @@ class SemanticLayerParser:
         Returns:
             Dictionary with metric definition or None
         """
-        metrics_list = self.metrics.get('metrics', [])
-        
-        for metric in metrics_list:
-            if metric.get('name') == metric_name:
-                return metric
-        
-        return None
+        return self._metrics_by_name.get(metric_name)
     
     def get_column_metadata(self, column_name: str) -> Optional[Dict]:
         """
@@ -91,21 +141,30 @@ class SemanticLayerParser:
         columns = self.metadata.get('columns', {})
         return columns.get(column_name)
     
-    def list_all_segments(self) -> Dict[str, list]:
-        """List all available customer segments"""
-        taxonomy = self.taxonomy.get('taxonomy', {})
-        
-        result = {}
-        for segment_type, segments in taxonomy.items():
-            if isinstance(segments, dict) and segment_type not in ['metadata']:
-                result[segment_type] = list(segments.keys())
-        
-        return result
+    def list_all_segments(self) -> Mapping[str, Tuple[str, ...]]:
+        """List all available customer segments (read-only view)"""
+        return self._segments_index
     
-    def list_all_metrics(self) -> list:
-        """List all available metrics"""
-        metrics_list = self.metrics.get('metrics', [])
-        return [m['name'] for m in metrics_list if 'name' in m]
+    def list_all_metrics(self) -> Tuple[str, ...]:
+        """List all available metrics (read-only)"""
+        return self._metrics_index
+
+
+def get_parser(semantic_dir: str = "semantic") -> SemanticLayerParser:
+    """
+    Shared parser for a semantic directory, loaded once per process
+    
+    The parser is read-only after loading, so every LLMClient and
+    QueryGenerator (and request handler threads) can share one instance.
+    Paths are resolved first, so different spellings of the same directory
+    share a parser and a later chdir doesn't change what a relative path means.
+    """
+    return _get_parser(Path(semantic_dir).resolve())
+
+
+@functools.cache
+def _get_parser(semantic_dir: Path) -> SemanticLayerParser:
+    return SemanticLayerParser(str(semantic_dir))
 
 
 # Test the parser
@@ -115,7 +174,7 @@ if __name__ == "__main__":
     print("="*60)
     
     # Initialize parser
-    parser = SemanticLayerParser()
+    parser = get_parser()
     
     # Test 1: List all segments
     print("\n1. Available Customer Segments:")